@@ -0,0 +1,139 @@
+"""
+Benchmark de memoria de Redis por cliente trackeado, para cada forma de guardar los contadores.
+
+Escenarios:
+    - legacy: claves legibles `limit:ip:{ip}`, una por cliente, cada una con su TTL (como antes de keyspace.py)
+    - string: claves compactas rl:{rule_id}{ip empaquetada}, una por cliente, cada una con su TTL
+    - hash: un field por cliente, repartidos en `--hash-buckets` hashes por regla, con un TTL por hash.
+      Por defecto se usa la misma cantidad de hashes que usaría la app para una regla con max_tracked_keys = `--clients`.
+      En Redis 7 o superior se usan los mismos comandos que la app (HINCRBY + EXPIRE NX)
+
+Para cada escenario se vacía la base elegida con FLUSHDB, se cargan `--clients` contadores, y se mide la diferencia
+de `used_memory` (ver https://redis.io/docs/latest/commands/info/).
+
+⚠️ ATENCION: Borra todo el contenido de la base `--db`. Usar una instancia de Redis de desarrollo, ej:
+    cd docker/ && docker compose up redis -d
+    python scripts/benchmark_keyspace.py --clients 1000000
+"""
+
+import argparse
+import ipaddress
+import os
+import sys
+from collections import Counter
+from collections.abc import Callable, Iterator
+
+import redis
+
+from api_proxy.keyspace import (
+    KeyspaceSettings,
+    counter_key,
+    hash_field,
+    hash_key,
+    make_rule_id,
+)
+
+# Cantidad de comandos que se mandan en cada pipeline
+BATCH_SIZE = 10_000
+
+# Cantidad de claves al azar que se revisan para reportar su encoding
+ENCODING_SAMPLE = 1000
+
+# Ventana de los contadores, lo suficientemente larga para que no expiren durante el benchmark
+WINDOW = 3600
+
+RULE_ID = make_rule_id("benchmark")
+
+
+def client_ips(count: int) -> Iterator[str]:
+    """Genera `count` IPv4 distintas, empezando por 10.0.0.0"""
+    first = int(ipaddress.IPv4Address("10.0.0.0"))
+    for i in range(count):
+        yield str(ipaddress.IPv4Address(first + i))
+
+
+def load_legacy(pipe: redis.client.Pipeline, ip: str, buckets: int) -> None:
+    """Carga el contador de ip con una clave legible y su propio TTL."""
+    pipe.set(f"limit:ip:{ip}", 1, ex=WINDOW)
+
+
+def load_string(pipe: redis.client.Pipeline, ip: str, buckets: int) -> None:
+    """Carga el contador de ip con una clave compacta y su propio TTL."""
+    pipe.set(counter_key(RULE_ID, ipaddress.ip_address(ip).packed), 1, ex=WINDOW)
+
+
+def load_hash(pipe: redis.client.Pipeline, ip: str, buckets: int) -> None:
+    """Carga el contador de ip como field de uno de los hashes de la regla, con un TTL por hash (EXPIRE NX, Redis 7+)."""
+    client = ipaddress.ip_address(ip).packed
+    key = hash_key(RULE_ID, client, buckets)
+    pipe.hincrby(key, hash_field(client), 1)
+    pipe.expire(key, WINDOW, nx=True)
+
+
+def load_hash_legacy_expire(pipe: redis.client.Pipeline, ip: str, buckets: int) -> None:
+    """Igual que load_hash, pero con EXPIRE sin NX, para poder correr el benchmark en Redis < 7. Ocupa la misma memoria"""
+    client = ipaddress.ip_address(ip).packed
+    key = hash_key(RULE_ID, client, buckets)
+    pipe.hincrby(key, hash_field(client), 1)
+    pipe.expire(key, WINDOW)
+
+
+SCENARIOS: dict[str, Callable[[redis.client.Pipeline, str, int], None]] = {
+    "legacy": load_legacy,
+    "string": load_string,
+    "hash": load_hash,
+}
+
+
+def measure(
+    client: redis.Redis, loader: Callable[[redis.client.Pipeline, str, int], None], clients: int, buckets: int
+) -> tuple[int, str]:
+    """
+    Carga `clients` contadores con loader y devuelve cuánta memoria usó Redis para guardarlos.
+
+    Returns:
+        tuple[int, str]: Diferencia de used_memory en bytes, y los encodings de una muestra de las claves cargadas
+    """
+    client.flushdb()
+    before = client.info("memory")["used_memory"]
+    pipe = client.pipeline(transaction=False)
+    for i, ip in enumerate(client_ips(clients), start=1):
+        loader(pipe, ip, buckets)
+        if i % BATCH_SIZE == 0:
+            pipe.execute()
+    pipe.execute()
+    after = client.info("memory")["used_memory"]
+    sample = Counter(client.object("encoding", client.randomkey()).decode() for _ in range(ENCODING_SAMPLE))
+    encodings = " ".join(f"{name}:{count * 100 // ENCODING_SAMPLE}%" for name, count in sample.most_common())
+    return after - before, encodings
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.environ.get("REDIS_HOST", "localhost"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("REDIS_PORT", "6379")))
+    parser.add_argument("--password", default=os.environ.get("REDIS_PASSWORD") or None)
+    parser.add_argument("--db", type=int, default=15, help="Base de Redis a usar (se vacía con FLUSHDB)")
+    parser.add_argument("--clients", type=int, default=1_000_000, help="Cantidad de clientes distintos a trackear")
+    parser.add_argument("--hash-buckets", type=int, help="Hashes por regla en el escenario hash (default: calculado)")
+    parser.add_argument("--scenario", choices=SCENARIOS, action="append", help="Escenario a correr (default: todos)")
+    args = parser.parse_args()
+    buckets = args.hash_buckets or KeyspaceSettings().buckets_for(args.clients)
+
+    client = redis.Redis(host=args.host, port=args.port, password=args.password, db=args.db)
+    server = client.info("server")
+    scenarios = dict(SCENARIOS)
+    if int(server["redis_version"].split(".")[0]) < 7:
+        scenarios["hash"] = load_hash_legacy_expire
+    allocator = client.info("memory")["mem_allocator"]
+    print(f"Redis {server['redis_version']} ({allocator}) - {args.clients} clientes - {buckets} hashes")
+    print(f"{'escenario':<10} {'MiB':>10} {'bytes/cliente':>15} {'encoding':>20}")
+    for name in args.scenario or scenarios:
+        used, encoding = measure(client, scenarios[name], args.clients, buckets)
+        print(f"{name:<10} {used / 2**20:>10.1f} {used / args.clients:>15.1f} {encoding:>20}")
+    client.flushdb()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
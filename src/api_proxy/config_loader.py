@@ -18,6 +18,7 @@ import yaml
 from watchdog.events import FileSystemEventHandler
 from watchdog.observers import Observer
 
+from .keyspace import KeyspaceSettings, parse_keyspace
 from .rules import Rule, parse_rules
 
 # See https://stackoverflow.com/a/77007723/15965186
@@ -38,14 +39,14 @@ class ConfigLoader:
             config_path (str): Ruta del archivo de config.
         """
         self.config_path = config_path
-        self.rules = self._load_config()
+        self.rules, self.keyspace = self._load_config()
 
-    def _load_config(self) -> list[Rule]:
+    def _load_config(self) -> tuple[list[Rule], KeyspaceSettings]:
         """
-        Carga el archivo YAML y extrae la sección de reglas.
+        Carga el archivo YAML y extrae las secciones de reglas y de keyspace.
 
         Returns:
-            dict: Diccionario con las reglas de configuración.
+            tuple[list[Rule], KeyspaceSettings]: Las reglas de configuración, y cómo guardar sus contadores en Redis.
         """
         logger.info("Cargando el archivo de config: %s", self.config_path)
         # Si no especificamos el encoding, pylint se queja :(
@@ -57,11 +58,14 @@ class ConfigLoader:
             parsed_rules = parse_rules(loaded_rules)
             logger.debug("REGLAS PARSEADAS:\n%s", pformat(parsed_rules))
 
-            return parsed_rules
+            keyspace = parse_keyspace(loaded_rules)
+            logger.debug("KEYSPACE: %s", keyspace)
+
+            return parsed_rules, keyspace
 
     def reload(self) -> None:
         """Recarga el archivo de config actualizando las reglas."""
-        self.rules = self._load_config()
+        self.rules, self.keyspace = self._load_config()
         logger.info("Se recargaron las reglas, ahora son:\n%s", pformat(self.rules))
 
 
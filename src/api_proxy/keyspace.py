@@ -0,0 +1,192 @@
+"""
+Módulo que define cómo se codifican las claves de rate limiting en Redis.
+
+En vez de usar strings legibles como `limit:ip_path:{ip}:{pattern}`, cada regla recibe al cargarse un id corto
+de 4 bytes, y la IP del cliente se guarda empaquetada en binario (4 bytes para IPv4, 16 para IPv6).
+
+Se soportan dos layouts:
+    - `string`: una clave de Redis por contador (con su propio TTL), igual que antes pero con claves compactas
+    - `hash`: los contadores de una ventana se guardan como fields de un hash, que tiene un único TTL
+
+Ver la sección "Keyspace de Redis" del README para más detalles.
+"""
+
+import hashlib
+import ipaddress
+import logging
+import math
+import zlib
+from typing import Any, Literal
+
+from pydantic import BaseModel, Field, ValidationError
+
+logger = logging.getLogger("uvicorn.error")
+
+# Prefijo común a todas las claves, permite identificarlas con SCAN MATCH rl:*
+KEY_PREFIX = b"rl:"
+
+# Largo en bytes del id de cada regla
+RULE_ID_SIZE = 4
+
+# Sufijo de la clave que cuenta cuántos clientes distintos trackea una regla en la ventana actual.
+# Como las IPs empaquetadas tienen 4 o 16 bytes, un sufijo de 1 byte nunca colisiona con una clave de cliente.
+TRACKER_SUFFIX = b"#"
+
+# Marca de las claves de los hashes (layout hash). Junto con la cantidad de hashes y el bucket, el sufijo tiene 5 bytes,
+# así que tampoco colisiona con las claves del layout string.
+HASH_MARKER = b"%"
+
+# Cliente compartido al que se le cuentan las requests de los clientes que exceden max_tracked_keys
+OVERFLOW_CLIENT = b"*"
+
+# Field usado en el layout hash para las reglas que no distinguen clientes (ej: PathRule)
+GLOBAL_FIELD = b"-"
+
+# Cantidad de clientes por hash que se busca al calcular hash_buckets. Es bastante menos que hash-max-listpack-entries
+# (512 por defecto en Redis), para que los hashes sigan siendo listpack aunque crc32 no reparta perfecto, y porque
+# buscar un field en un listpack es lineal, así que hashes más chicos hacen que HINCRBY sea más barato.
+HASH_BUCKET_FIELDS = 64
+
+# Cantidad de hashes de las reglas sin max_tracked_keys, alcanza para ~1M de clientes con HASH_BUCKET_FIELDS por hash
+DEFAULT_HASH_BUCKETS = 16384
+
+# Máximo de hashes por regla, ya que el bucket se guarda en 2 bytes de la clave
+MAX_HASH_BUCKETS = 0xFFFF
+
+
+class KeyspaceSettings(BaseModel):
+    """
+    Configuración de cómo se guardan los contadores en Redis.
+
+    Atributos:
+        layout (Literal['string', 'hash']): Una clave por contador, o un hash por ventana de cada regla
+        hash_buckets (int | None): En el layout hash, cantidad de hashes entre los que se reparten los clientes
+            de cada regla. Si no se define, se calcula para cada regla, ver buckets_for
+    """
+
+    layout: Literal["string", "hash"] = Field(default="string", description="Layout de los contadores en Redis")
+    hash_buckets: int | None = Field(
+        default=None, gt=0, le=MAX_HASH_BUCKETS, description="Cantidad de hashes por regla (solo para layout hash)"
+    )
+
+    def buckets_for(self, max_tracked_keys: int | None) -> int:
+        """
+        Devuelve la cantidad de hashes entre los que se reparten los clientes de una regla.
+
+        Si hash_buckets está definido se usa ese valor. Si no, se calcula a partir de la cantidad de clientes
+        que puede tener la regla, para que cada hash tenga ~HASH_BUCKET_FIELDS clientes.
+
+        Args:
+            max_tracked_keys (int | None): Máximo de clientes de la regla (None si no tiene límite)
+
+        Returns:
+            int: Cantidad de hashes, entre 1 y MAX_HASH_BUCKETS
+        """
+        if self.hash_buckets is not None:
+            return self.hash_buckets
+        if max_tracked_keys is None:
+            return DEFAULT_HASH_BUCKETS
+        return min(math.ceil(max_tracked_keys / HASH_BUCKET_FIELDS), MAX_HASH_BUCKETS)
+
+
+def make_rule_id(identity: str) -> bytes:
+    """
+    Genera el id corto de una regla a partir de los campos que la identifican.
+
+    Se usa un digest en vez de un contador incremental para que el id sea el mismo en todas las réplicas,
+    y no cambie si se reordenan las reglas en config.yaml.
+
+    Args:
+        identity (str): Representación estable de la regla
+
+    Returns:
+        bytes: Id de RULE_ID_SIZE bytes
+    """
+    return hashlib.blake2b(identity.encode("utf-8"), digest_size=RULE_ID_SIZE).digest()
+
+
+def pack_ip(ip: str) -> bytes:
+    """
+    Empaqueta una IP en binario.
+
+    Args:
+        ip (str): Dirección IPv4 o IPv6
+
+    Returns:
+        bytes: 4 bytes para IPv4, 16 para IPv6
+
+    Raises:
+        ValueError: Si ip no es una dirección válida
+    """
+    return ipaddress.ip_address(ip).packed
+
+
+def counter_key(rule_id: bytes, client: bytes) -> bytes:
+    """Genera la clave del layout string, en formato: rl:{rule_id}{client}"""
+    return KEY_PREFIX + rule_id + client
+
+
+def tracker_key(rule_id: bytes, buckets: int | None = None) -> bytes:
+    """
+    Genera la clave que cuenta los clientes trackeados por una regla.
+
+    En el layout hash, la cantidad de hashes es parte de la clave (igual que en hash_key), para que al cambiarla
+    el tracker empiece de cero junto con los hashes nuevos, en vez de contar otra vez a los clientes ya trackeados.
+
+    Args:
+        rule_id (bytes): Id de la regla
+        buckets (int | None): Cantidad de hashes por regla en el layout hash (None en el layout string)
+
+    Returns:
+        bytes: Clave en formato rl:{rule_id}#, o rl:{rule_id}#{buckets} en el layout hash (buckets en 2 bytes big-endian)
+    """
+    if buckets is None:
+        return KEY_PREFIX + rule_id + TRACKER_SUFFIX
+    return KEY_PREFIX + rule_id + TRACKER_SUFFIX + buckets.to_bytes(2, "big")
+
+
+def hash_key(rule_id: bytes, client: bytes, buckets: int) -> bytes:
+    """
+    Genera la clave del hash (layout hash) en el que se guarda el contador de client.
+
+    Los clientes se reparten entre `buckets` hashes para que cada uno sea chico y Redis pueda guardarlo
+    con el encoding compacto (listpack), ver hash-max-listpack-entries en la config de Redis.
+
+    La cantidad de hashes es parte de la clave: si cambia (ej: al cambiar max_tracked_keys), cada cliente cae en otro
+    bucket, así que se usan hashes nuevos en vez de mezclar contadores con los de la cantidad anterior.
+
+    Args:
+        rule_id (bytes): Id de la regla
+        client (bytes): Cliente empaquetado (vacío si la regla no distingue clientes)
+        buckets (int): Cantidad de hashes por regla
+
+    Returns:
+        bytes: Clave en formato rl:{rule_id}%{buckets}{bucket}, con buckets y bucket en 2 bytes big-endian
+    """
+    bucket = zlib.crc32(client) % buckets
+    return KEY_PREFIX + rule_id + HASH_MARKER + buckets.to_bytes(2, "big") + bucket.to_bytes(2, "big")
+
+
+def hash_field(client: bytes) -> bytes:
+    """Devuelve el field del hash para client, o GLOBAL_FIELD si la regla no distingue clientes."""
+    return client or GLOBAL_FIELD
+
+
+def parse_keyspace(raw_data: dict[str, Any]) -> KeyspaceSettings:
+    """
+    Obtiene la configuración del keyspace a partir de los datos crudos de config.yaml.
+
+    Args:
+        raw_data (dict[str, Any]): Diccionario con la sección opcional `keyspace`
+
+    Returns:
+        KeyspaceSettings: Configuración validada (o la default si no hay sección `keyspace`)
+
+    Raises:
+        ValidationError: Si hay valores inválidos
+    """
+    try:
+        return KeyspaceSettings(**(raw_data.get("keyspace") or {}))
+    except ValidationError as e:
+        logger.error("Error validando la sección keyspace: %s", e.json())
+        raise
@@ -52,7 +52,7 @@ async def lifespan(app: FastAPI):
 
     # === Rate Limiter
     # Guardamos la configuración del rate limiter en base a las reglas de configuración
-    app.state.rate_limiter = RateLimiter(app.state.redis_client, config.rules)
+    app.state.rate_limiter = RateLimiter(app.state.redis_client, config.rules, config.keyspace)
 
     # Iniciar watcher para cambios en config.yaml
     app.state.watcher = ConfigWatcher(config.config_path, config.reload)
@@ -7,26 +7,100 @@ from pprint import pformat
 
 import redis.asyncio
 
-from .rules import Rule
+from .keyspace import (
+    OVERFLOW_CLIENT,
+    KeyspaceSettings,
+    counter_key,
+    hash_field,
+    hash_key,
+    tracker_key,
+)
+from .rules import ClientRule, Rule
 
 logger = logging.getLogger("uvicorn.error")
 
+# Scripts de Lua para las reglas con max_tracked_keys, ver https://redis.io/docs/latest/develop/interact/programmability/eval-intro/
+# Se usan scripts para que chequear el cap, registrar el cliente en el tracker y crear su contador sea atómico.
+# El contador de un cliente nuevo, y el contador compartido de overflow, expiran junto con el tracker (mismo PTTL),
+# así que el tracker siempre cuenta exactamente los clientes que tienen un contador vivo, y ningún contador
+# sobrevive a la ventana del tracker.
+# Devuelven {trackeado, contador}: trackeado es 1 si el cliente tiene su propio contador, y 0 si la regla ya alcanzó
+# max_tracked_keys. En ese caso, contador es el valor del contador compartido si overflow es "shared", y si no 0.
+
+# KEYS[1]: contador del cliente, KEYS[2]: tracker de la regla, KEYS[3]: contador compartido de overflow
+# ARGV[1]: window en segundos, ARGV[2]: max_tracked_keys, ARGV[3]: overflow
+TRACKED_INCR_STRING = """
+if redis.call("EXISTS", KEYS[1]) == 1 then
+    return {1, redis.call("INCR", KEYS[1])}
+end
+local tracked = tonumber(redis.call("GET", KEYS[2]) or "0")
+if tracked >= tonumber(ARGV[2]) then
+    if ARGV[3] ~= "shared" then
+        return {0, 0}
+    end
+    local current = redis.call("INCR", KEYS[3])
+    if current == 1 then
+        redis.call("PEXPIRE", KEYS[3], redis.call("PTTL", KEYS[2]))
+    end
+    return {0, current}
+end
+if tracked == 0 then
+    redis.call("SET", KEYS[2], 1, "EX", ARGV[1])
+else
+    redis.call("INCR", KEYS[2])
+end
+redis.call("SET", KEYS[1], 1, "PX", redis.call("PTTL", KEYS[2]))
+return {1, 1}
+"""
+
+# KEYS[1]: hash del contador del cliente, KEYS[2]: tracker de la regla, KEYS[3]: hash del contador compartido de overflow
+# ARGV[1]: field del cliente, ARGV[2]: field de overflow, ARGV[3]: window en segundos, ARGV[4]: max_tracked_keys,
+# ARGV[5]: overflow
+TRACKED_INCR_HASH = """
+if redis.call("HEXISTS", KEYS[1], ARGV[1]) == 1 then
+    return {1, redis.call("HINCRBY", KEYS[1], ARGV[1], 1)}
+end
+local tracked = tonumber(redis.call("GET", KEYS[2]) or "0")
+if tracked >= tonumber(ARGV[4]) then
+    if ARGV[5] ~= "shared" then
+        return {0, 0}
+    end
+    local current = redis.call("HINCRBY", KEYS[3], ARGV[2], 1)
+    if current == 1 then
+        redis.call("PEXPIRE", KEYS[3], redis.call("PTTL", KEYS[2]))
+    end
+    return {0, current}
+end
+if tracked == 0 then
+    redis.call("SET", KEYS[2], 1, "EX", ARGV[3])
+else
+    redis.call("INCR", KEYS[2])
+end
+redis.call("HSET", KEYS[1], ARGV[1], 1)
+redis.call("PEXPIRE", KEYS[1], redis.call("PTTL", KEYS[2]))
+return {1, 1}
+"""
+
 
 class RateLimiter:
     """
     Servicio principal que aplica las reglas de rate limiting.
     """
 
-    def __init__(self, redis_client: redis.asyncio.Redis, rules: list[Rule]):
+    def __init__(self, redis_client: redis.asyncio.Redis, rules: list[Rule], keyspace: KeyspaceSettings | None = None):
         """
         Inicializa el rate limiter.
 
         Args:
             redis_client (redis.Redis): Cliente Redis configurado
             rules (list[Rule]): Lista de reglas a aplicar
+            keyspace (KeyspaceSettings | None): Layout de los contadores en Redis (por defecto, layout string)
         """
         self.redis = redis_client
         self.rules = rules
+        self.keyspace = keyspace or KeyspaceSettings()
+        self._tracked_incr_string = self.redis.register_script(TRACKED_INCR_STRING)
+        self._tracked_incr_hash = self.redis.register_script(TRACKED_INCR_HASH)
 
     def load_rules(self, rules: list[Rule]):
         """
@@ -59,19 +133,25 @@ class RateLimiter:
                 continue
             logger.debug("❗ La regla aplica!")
 
-            key = rule.generate_key(ip, path)
-            logger.debug("Key generada en Redis: %s", key)
+            client = rule.client_id(ip, path)
 
             try:
-                current = await self.redis.incr(key)
+                if isinstance(rule, ClientRule) and rule.max_tracked_keys is not None:
+                    tracked, current = await self._increment_tracked(rule, client, rule.max_tracked_keys)
+                    if not tracked:
+                        # Es un cliente nuevo, y la regla ya trackea max_tracked_keys clientes en esta ventana.
+                        # Con overflow "shared", current es el valor del contador compartido por la regla
+                        logger.warning("La regla %s alcanzó max_tracked_keys - aplicando overflow %s", rule, rule.overflow)
+                        if rule.overflow == "deny":
+                            return False
+                        if rule.overflow == "allow":
+                            continue
+                else:
+                    current = await self._increment(rule, client)
                 logger.debug("Valor actual del contador: %s", current)
 
-                if current == 1:
-                    logger.debug("Primera solicitud - configurando TTL a %s segundos", rule.window)
-                    await self.redis.expire(key, rule.window)
-
                 if current > rule.limit:
-                    logger.warning("Límite excedido para %s", key)
+                    logger.warning("Límite excedido para %s", rule)
                     return False
             except redis.RedisError as e:
                 logger.error("Error de Redis: %s - Permitiendo solicitudes por fallo del Redis", str(e))
@@ -79,3 +159,74 @@ class RateLimiter:
 
         logger.debug("Todas las reglas fueron evaluadas")
         return True
+
+    async def _increment(self, rule: Rule, client: bytes) -> int:
+        """
+        Incrementa en 1 el contador de client para la regla, según el layout configurado.
+
+        En el layout string, el TTL se configura en la primera solicitud de cada clave.
+        En el layout hash, el TTL lo configura quien crea el hash (EXPIRE NX), y todos sus fields expiran juntos.
+
+        Args:
+            rule (Rule): Regla que aplica
+            client (bytes): Cliente empaquetado (vacío si la regla no distingue clientes)
+
+        Returns:
+            int: Valor del contador luego de incrementarlo
+        """
+        if self.keyspace.layout == "hash":
+            key = hash_key(rule.rule_id, client, self._hash_buckets(rule))
+            logger.debug("Key generada en Redis: %r, field: %r", key, hash_field(client))
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.hincrby(key, hash_field(client), 1)
+                pipe.expire(key, rule.window, nx=True)
+                current, _ = await pipe.execute()
+            return int(current)
+
+        key = counter_key(rule.rule_id, client)
+        logger.debug("Key generada en Redis: %r", key)
+        current = await self.redis.incr(key)
+        if current == 1:
+            logger.debug("Primera solicitud - configurando TTL a %s segundos", rule.window)
+            await self.redis.expire(key, rule.window)
+        return current
+
+    async def _increment_tracked(self, rule: ClientRule, client: bytes, max_tracked_keys: int) -> tuple[bool, int]:
+        """
+        Incrementa en 1 el contador de client para una regla con max_tracked_keys, según el layout configurado.
+
+        Si client no tiene contador y la regla ya trackea max_tracked_keys clientes, no se le crea un contador.
+        Con overflow "shared" se incrementa el contador compartido de la regla, y si no, no se escribe nada en Redis.
+        Los contadores creados acá expiran junto con el tracker de la regla, así que todos los clientes
+        de la regla comparten la ventana, que empieza con el primer cliente trackeado.
+
+        Args:
+            rule (ClientRule): Regla que aplica
+            client (bytes): Cliente empaquetado
+            max_tracked_keys (int): Máximo de clientes trackeados por la regla
+
+        Returns:
+            tuple[bool, int]: Si client entra en max_tracked_keys, y el valor de su contador luego de incrementarlo
+                (o del contador compartido si no entra y overflow es "shared", o 0 si no se contó)
+        """
+        if self.keyspace.layout == "hash":
+            buckets = self._hash_buckets(rule)
+            key = hash_key(rule.rule_id, client, buckets)
+            logger.debug("Key generada en Redis: %r, field: %r", key, hash_field(client))
+            tracked, current = await self._tracked_incr_hash(
+                keys=[key, tracker_key(rule.rule_id, buckets), hash_key(rule.rule_id, OVERFLOW_CLIENT, buckets)],
+                args=[hash_field(client), hash_field(OVERFLOW_CLIENT), rule.window, max_tracked_keys, rule.overflow],
+            )
+            return bool(int(tracked)), int(current)
+
+        key = counter_key(rule.rule_id, client)
+        logger.debug("Key generada en Redis: %r", key)
+        tracked, current = await self._tracked_incr_string(
+            keys=[key, tracker_key(rule.rule_id), counter_key(rule.rule_id, OVERFLOW_CLIENT)],
+            args=[rule.window, max_tracked_keys, rule.overflow],
+        )
+        return bool(int(tracked)), int(current)
+
+    def _hash_buckets(self, rule: Rule) -> int:
+        """Devuelve la cantidad de hashes de la regla en el layout hash, ver KeyspaceSettings.buckets_for"""
+        return self.keyspace.buckets_for(rule.max_tracked_keys if isinstance(rule, ClientRule) else None)
@@ -2,11 +2,13 @@
 Módulo que define las reglas de rate limiting y su lógica asociada.
 """
 
+import ipaddress
 import logging
 from typing import Any, Literal
 
-from pydantic import BaseModel, Field, ValidationError
+from pydantic import BaseModel, Field, PrivateAttr, ValidationError
 
+from .keyspace import counter_key, make_rule_id, pack_ip
 from .utils import matches_pattern
 
 logger = logging.getLogger("uvicorn.error")
@@ -28,6 +30,34 @@ class Rule(BaseModel):
     limit: int = Field(..., gt=0, description="Límite máximo de peticiones")
     window: int = Field(..., gt=0, description="Duración de la ventana en segundos")
 
+    # Id corto de la regla, usado en las claves de Redis. Se asigna al cargar las reglas, ver parse_rules
+    _rule_id: bytes | None = PrivateAttr(None)
+
+    @property
+    def rule_id(self) -> bytes:
+        """Id corto de la regla. Si no fue asignado por parse_rules, se calcula a partir de la identidad de la regla."""
+        if self._rule_id is None:
+            return self.assign_rule_id()
+        return self._rule_id
+
+    def assign_rule_id(self, occurrence: int = 0) -> bytes:
+        """
+        Asigna el id corto de la regla a partir de los campos que la identifican.
+
+        No se incluyen limit, window, ni los campos del cap de ClientRule, para que cambiar esos valores en config.yaml
+        no reinicie los contadores (igual que pasaba con las claves legibles). En el layout hash, cambiar
+        max_tracked_keys sí los reinicia, porque cambia la cantidad de hashes de la regla (ver keyspace.hash_key).
+
+        Args:
+            occurrence (int): Cuántas reglas con la misma identidad aparecen antes que esta en la config
+
+        Returns:
+            bytes: El id asignado
+        """
+        identity = self.model_dump_json(exclude={"limit", "window", "max_tracked_keys", "overflow"})
+        self._rule_id = make_rule_id(f"{identity}#{occurrence}")
+        return self._rule_id
+
     def matches(self, ip: str, path: str) -> bool:
         """
         Determina si la regla aplica a la combinación ip/path recibida.
@@ -44,22 +74,35 @@ class Rule(BaseModel):
         """
         raise NotImplementedError("Método abstracto: debe implementarse en subclases")
 
-    def generate_key(self, ip: str, path: str) -> str:
+    def client_id(self, ip: str, path: str) -> bytes:
         """
-        Genera la clave única para identificar esta regla en Redis.
+        Genera el identificador binario del cliente que se cuenta para esta regla.
 
         Args:
             ip (str): Dirección IP del cliente
             path (str): Ruta accedida
 
         Returns:
-            str: Clave Redis para el contador
+            bytes: Cliente empaquetado, o b"" si la regla tiene un único contador
 
         Raises:
             NotImplementedError: Si la subclase no implementa este método
         """
         raise NotImplementedError("Método abstracto: debe implementarse en subclases")
 
+    def generate_key(self, ip: str, path: str) -> bytes:
+        """
+        Genera la clave única para identificar esta regla en Redis (layout string).
+
+        Args:
+            ip (str): Dirección IP del cliente
+            path (str): Ruta accedida
+
+        Returns:
+            bytes: Clave Redis para el contador, en formato rl:{rule_id}{client_id}
+        """
+        return counter_key(self.rule_id, self.client_id(ip, path))
+
 
 class IPRule(Rule):
     """
@@ -77,9 +120,9 @@ class IPRule(Rule):
         """Verifica si la IP recibida coincide con la de la regla."""
         return ip == self.ip
 
-    def generate_key(self, ip: str, path: str) -> str:
-        """Genera clave en formato: limit:ip:{ip}"""
-        return f"limit:ip:{self.ip}"
+    def client_id(self, ip: str, path: str) -> bytes:
+        """Devuelve la IP de la regla empaquetada en 4 bytes."""
+        return pack_ip(self.ip)
 
 
 class PathRule(Rule):
@@ -98,9 +141,9 @@ class PathRule(Rule):
         """Verifica si la ruta recibida coincide con el patrón."""
         return matches_pattern(path, self.pattern)
 
-    def generate_key(self, ip: str, path: str) -> str:
-        """Genera clave en formato: limit:path:{pattern}"""
-        return f"limit:path:{self.pattern}"
+    def client_id(self, ip: str, path: str) -> bytes:
+        """Las reglas por ruta tienen un único contador compartido, así que no hay cliente."""
+        return b""
 
 
 class IPPathRule(Rule):
@@ -121,18 +164,57 @@ class IPPathRule(Rule):
         """Verifica coincidencia de IP y ruta simultáneamente."""
         return ip == self.ip and matches_pattern(path, self.pattern)
 
-    def generate_key(self, ip: str, path: str) -> str:
-        """Genera clave en formato: limit:ip_path:{ip}:{pattern}"""
-        return f"limit:ip_path:{self.ip}:{self.pattern}"
+    def client_id(self, ip: str, path: str) -> bytes:
+        """Devuelve la IP de la regla empaquetada en 4 bytes."""
+        return pack_ip(self.ip)
+
+
+class ClientRule(Rule):
+    """
+    Regla que aplica el límite a cada IP cliente (IPv4 o IPv6) por separado, dentro de una red.
+
+    A diferencia de IPRule, cada IP de la red tiene su propio contador, por lo que la cantidad de contadores
+    en Redis crece con la cantidad de clientes. Para acotarla, ver max_tracked_keys.
+
+    Atributos:
+        type (Literal['client']): Identificador del tipo de regla (fijo: 'client')
+        cidr (IPv4Network | IPv6Network | None): Red a la que aplica la regla (None = todas las IPv4 e IPv6)
+        pattern (str | None): Patrón de ruta a coincidir (default: todas las rutas)
+        max_tracked_keys (int | None): Máximo de clientes distintos trackeados por ventana (None = sin límite).
+        overflow (Literal['shared', 'allow', 'deny']): Qué hacer con los clientes que exceden max_tracked_keys.
+    """
+
+    type: Literal["client"] = "client"
+    cidr: ipaddress.IPv4Network | ipaddress.IPv6Network | None = Field(default=None, examples=["10.0.0.0/8", "2001:db8::/32"])
+    pattern: str | None = Field(default=None, min_length=1, examples=["items/*"])
+    max_tracked_keys: int | None = Field(default=None, gt=0, description="Máximo de clientes trackeados por ventana")
+    overflow: Literal["shared", "allow", "deny"] = Field(default="shared", description="Política al exceder max_tracked_keys")
+
+    def matches(self, ip: str, path: str) -> bool:
+        """Verifica que la IP recibida esté dentro de la red (si hay), y que la ruta coincida con el patrón (si hay)."""
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+        if self.cidr is not None and address not in self.cidr:
+            return False
+        return self.pattern is None or matches_pattern(path, self.pattern)
+
+    def client_id(self, ip: str, path: str) -> bytes:
+        """Devuelve la IP del cliente empaquetada en binario."""
+        return pack_ip(ip)
 
 
-Rule = IPRule | PathRule | IPPathRule
+Rule = IPRule | PathRule | IPPathRule | ClientRule
 
 
 def parse_rules(raw_data: dict[str, Any]) -> list[Rule]:
     """
     Convierte datos crudos (generalmente de YAML) en objetos Rule válidos.
 
+    Cada regla recibe su id corto (ver Rule.assign_rule_id). Las reglas repetidas reciben ids distintos,
+    para que no compartan contadores en Redis.
+
     Args:
         raw_data (dict[str, Any]): Diccionario con estructura específica
 
@@ -142,13 +224,14 @@ def parse_rules(raw_data: dict[str, Any]) -> list[Rule]:
     Raises:
         KeyError: Si falta algún campo obligatorio
         ValidationError: Si hay valores inválidos
+        ValueError: Si dos reglas distintas reciben el mismo id
 
     Example:
         >>> data = {"rules": [{"type": "ip", "ip": "192.168.1.1", "limit": 100, "window": 60}]}
         >>> parse_rules(data)
-        [IPRule(type='ip', ip='192.168.1.1', limit=100, window=60)]
+        [IPRule(limit=100, window=60, type='ip', ip='192.168.1.1')]
     """
-    parsed_rules = []
+    parsed_rules: list[Rule] = []
     for rule in raw_data.get("rules", []):
         try:
             rule_type = rule["type"]
@@ -158,6 +241,8 @@ def parse_rules(raw_data: dict[str, Any]) -> list[Rule]:
                 parsed_rules.append(PathRule(**rule))
             elif rule_type == "ip_path":
                 parsed_rules.append(IPPathRule(**rule))
+            elif rule_type == "client":
+                parsed_rules.append(ClientRule(**rule))
             else:
                 logger.warning("Tipo de regla desconocido: %s - omitiendo", rule_type)
         except KeyError as e:
@@ -166,4 +251,16 @@ def parse_rules(raw_data: dict[str, Any]) -> list[Rule]:
         except ValidationError as e:
             logger.error("Error validando regla: %s", e.json())
             raise
+
+    # Cantidad de veces que apareció cada identidad, para distinguir reglas repetidas
+    occurrences: dict[bytes, int] = {}
+    assigned_ids: set[bytes] = set()
+    for rule in parsed_rules:
+        base_id = rule.assign_rule_id()
+        rule_id = rule.assign_rule_id(occurrences.get(base_id, 0))
+        occurrences[base_id] = occurrences.get(base_id, 0) + 1
+        if rule_id in assigned_ids:
+            logger.error("Colisión de id de regla %s en %s", rule_id.hex(), rule)
+            raise ValueError(f"Colisión de id de regla {rule_id.hex()}, cambiar el orden o los campos de la regla")
+        assigned_ids.add(rule_id)
     return parsed_rules
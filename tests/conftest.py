@@ -0,0 +1,24 @@
+"""
+Fixtures compartidas por los tests.
+"""
+
+import fakeredis
+import pytest
+
+
+@pytest.fixture
+def redis_server() -> fakeredis.FakeServer:
+    """Server de Redis en memoria, uno por test para que los tests no compartan datos."""
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def redis_client(redis_server: fakeredis.FakeServer) -> fakeredis.FakeAsyncRedis:
+    """Cliente configurado igual que setup_redis_client en utils.py (con decode_responses=True)."""
+    return fakeredis.FakeAsyncRedis(server=redis_server, decode_responses=True)
+
+
+@pytest.fixture
+def raw_redis_client(redis_server: fakeredis.FakeServer) -> fakeredis.FakeAsyncRedis:
+    """Cliente sin decode_responses, para poder leer las claves binarias que genera el rate limiter."""
+    return fakeredis.FakeAsyncRedis(server=redis_server)
@@ -0,0 +1,79 @@
+"""
+Tests de la codificación de claves y de la config del keyspace.
+"""
+
+import pytest
+from pydantic import ValidationError
+
+from api_proxy.keyspace import (
+    DEFAULT_HASH_BUCKETS,
+    GLOBAL_FIELD,
+    MAX_HASH_BUCKETS,
+    KeyspaceSettings,
+    counter_key,
+    hash_field,
+    hash_key,
+    make_rule_id,
+    pack_ip,
+    parse_keyspace,
+    tracker_key,
+)
+
+RULE_ID = b"\x01\x02\x03\x04"
+
+
+def test_make_rule_id_is_short_and_stable():
+    assert len(make_rule_id("regla")) == 4
+    assert make_rule_id("regla") == make_rule_id("regla")
+    assert make_rule_id("regla") != make_rule_id("otra regla")
+
+
+def test_pack_ip():
+    assert pack_ip("10.1.2.3") == b"\x0a\x01\x02\x03"
+    assert len(pack_ip("2001:db8::1")) == 16
+    with pytest.raises(ValueError):
+        pack_ip("no-es-una-ip")
+
+
+def test_key_formats():
+    client = pack_ip("10.1.2.3")
+    assert counter_key(RULE_ID, client) == b"rl:\x01\x02\x03\x04\x0a\x01\x02\x03"
+    assert counter_key(RULE_ID, b"") == b"rl:\x01\x02\x03\x04"
+    assert tracker_key(RULE_ID) == b"rl:\x01\x02\x03\x04#"
+    assert tracker_key(RULE_ID, 16) == b"rl:\x01\x02\x03\x04#\x00\x10"
+    # Con un solo hash, todos los clientes van al bucket 0
+    assert hash_key(RULE_ID, client, 1) == b"rl:\x01\x02\x03\x04%\x00\x01\x00\x00"
+    # La cantidad de hashes es parte de la clave
+    assert hash_key(RULE_ID, client, 2) != hash_key(RULE_ID, client, 1)
+
+
+def test_hash_key_spreads_clients_between_buckets():
+    keys = {hash_key(RULE_ID, pack_ip(f"10.0.{i // 256}.{i % 256}"), 16) for i in range(1000)}
+    assert len(keys) == 16
+
+
+def test_hash_field():
+    client = pack_ip("10.1.2.3")
+    assert hash_field(client) == client
+    assert hash_field(b"") == GLOBAL_FIELD
+
+
+def test_buckets_for():
+    settings = KeyspaceSettings()
+    assert settings.buckets_for(None) == DEFAULT_HASH_BUCKETS
+    assert settings.buckets_for(10) == 1
+    assert settings.buckets_for(100_000) == 1563
+    assert settings.buckets_for(10**9) == MAX_HASH_BUCKETS
+    # Si se define hash_buckets, se usa para todas las reglas
+    assert KeyspaceSettings(hash_buckets=7).buckets_for(100_000) == 7
+
+
+def test_parse_keyspace():
+    assert parse_keyspace({}) == KeyspaceSettings(layout="string", hash_buckets=None)
+    assert parse_keyspace({"keyspace": {"layout": "hash", "hash_buckets": 16}}) == KeyspaceSettings(
+        layout="hash", hash_buckets=16
+    )
+    with pytest.raises(ValidationError):
+        parse_keyspace({"keyspace": {"layout": "list"}})
+    with pytest.raises(ValidationError):
+        parse_keyspace({"keyspace": {"hash_buckets": 0}})
@@ -0,0 +1,222 @@
+"""
+Tests del RateLimiter, contra un Redis en memoria (fakeredis).
+"""
+
+import asyncio
+
+import pytest
+import redis
+
+from api_proxy.keyspace import (
+    OVERFLOW_CLIENT,
+    KeyspaceSettings,
+    hash_key,
+    pack_ip,
+    tracker_key,
+)
+from api_proxy.rate_limiter import RateLimiter
+from api_proxy.rules import parse_rules
+
+LAYOUTS = ["string", "hash"]
+
+
+def make_limiter(redis_client, rules, layout="string", hash_buckets=None):
+    """Crea un RateLimiter con las reglas crudas (como las de config.yaml) y el layout pedido."""
+    keyspace = KeyspaceSettings(layout=layout, hash_buckets=hash_buckets)
+    return RateLimiter(redis_client, parse_rules({"rules": rules}), keyspace)
+
+
+async def send(limiter, ip, path, times):
+    """Hace `times` requests y devuelve el resultado de is_allowed de cada una."""
+    return [await limiter.is_allowed(ip, path) for _ in range(times)]
+
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+def test_limit_per_rule(redis_client, layout):
+    limiter = make_limiter(
+        redis_client,
+        [
+            {"type": "ip", "ip": "1.1.1.1", "limit": 2, "window": 60},
+            {"type": "path", "pattern": "items/*", "limit": 3, "window": 60},
+        ],
+        layout,
+    )
+
+    async def scenario():
+        assert await send(limiter, "1.1.1.1", "users/1", 3) == [True, True, False]
+        # La regla path tiene un único contador compartido por todas las IPs
+        assert await send(limiter, "2.2.2.2", "items/1", 2) == [True, True]
+        assert await send(limiter, "3.3.3.3", "items/2", 2) == [True, False]
+        # Ninguna regla aplica
+        assert await send(limiter, "4.4.4.4", "users/1", 5) == [True] * 5
+
+    asyncio.run(scenario())
+
+
+def test_string_layout_sets_ttl_per_key(redis_client, raw_redis_client):
+    limiter = make_limiter(redis_client, [{"type": "client", "limit": 5, "window": 60}])
+
+    async def scenario():
+        await limiter.is_allowed("10.0.0.1", "a")
+        await limiter.is_allowed("10.0.0.2", "a")
+        rule = limiter.rules[0]
+        assert sorted(await raw_redis_client.keys()) == sorted(
+            [rule.generate_key("10.0.0.1", "a"), rule.generate_key("10.0.0.2", "a")]
+        )
+        for key in await raw_redis_client.keys():
+            assert 0 < await raw_redis_client.ttl(key) <= 60
+
+    asyncio.run(scenario())
+
+
+def test_hash_layout_stores_counters_as_fields(redis_client, raw_redis_client):
+    limiter = make_limiter(redis_client, [{"type": "client", "limit": 5, "window": 60}], "hash", hash_buckets=1)
+
+    async def scenario():
+        for i in range(10):
+            await limiter.is_allowed(f"10.0.0.{i}", "a")
+        (key,) = await raw_redis_client.keys()
+        assert key == hash_key(limiter.rules[0].rule_id, b"", 1)
+        assert await raw_redis_client.hget(key, pack_ip("10.0.0.3")) == b"1"
+        assert await raw_redis_client.hlen(key) == 10
+        assert 0 < await raw_redis_client.ttl(key) <= 60
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+def test_client_rule_counts_each_client(redis_client, layout):
+    limiter = make_limiter(redis_client, [{"type": "client", "cidr": "10.0.0.0/8", "limit": 2, "window": 60}], layout)
+
+    async def scenario():
+        assert await send(limiter, "10.0.0.1", "a", 3) == [True, True, False]
+        assert await send(limiter, "10.0.0.2", "a", 3) == [True, True, False]
+        # Fuera de la red, la regla no aplica
+        assert await send(limiter, "11.0.0.1", "a", 3) == [True, True, True]
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+def test_client_rule_limits_ipv6_clients(redis_client, layout):
+    rule = {"type": "client", "limit": 2, "window": 60, "max_tracked_keys": 10, "overflow": "deny"}
+    limiter = make_limiter(redis_client, [rule], layout)
+
+    async def scenario():
+        assert await send(limiter, "2001:db8::1", "a", 3) == [True, True, False]
+        assert await send(limiter, "2001:db8::2", "a", 3) == [True, True, False]
+        assert await send(limiter, "10.0.0.1", "a", 3) == [True, True, False]
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+@pytest.mark.parametrize(
+    ("overflow", "expected"),
+    [
+        # Los clientes 0 y 1 entran en el cap. Con shared, el 2 y el 3 comparten un contador de 2 requests
+        ("shared", [True, True, True, True, True, True, False, False]),
+        # Con allow, los que no entran no se cuentan
+        ("allow", [True, True, True, True, True, True, True, True]),
+        # Con deny, los que no entran se rechazan
+        ("deny", [True, True, True, True, False, False, False, False]),
+    ],
+)
+def test_overflow_policies(redis_client, layout, overflow, expected):
+    rule = {"type": "client", "limit": 2, "window": 60, "max_tracked_keys": 2, "overflow": overflow}
+    limiter = make_limiter(redis_client, [rule], layout)
+
+    async def scenario():
+        results = []
+        for i in range(4):
+            results += await send(limiter, f"10.0.0.{i}", "a", 2)
+        assert results == expected
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+def test_max_tracked_keys_bounds_live_counters(redis_client, raw_redis_client, layout):
+    rule = {"type": "client", "limit": 100, "window": 60, "max_tracked_keys": 5, "overflow": "allow"}
+    limiter = make_limiter(redis_client, [rule], layout, hash_buckets=1)
+
+    async def scenario():
+        for _ in range(3):
+            for i in range(20):
+                await limiter.is_allowed(f"10.0.0.{i}", "a")
+        tracker = tracker_key(limiter.rules[0].rule_id, 1 if layout == "hash" else None)
+        assert int(await raw_redis_client.get(tracker)) == 5
+        if layout == "hash":
+            (key,) = [key for key in await raw_redis_client.keys() if key != tracker]
+            assert await raw_redis_client.hlen(key) == 5
+        else:
+            # 5 contadores + el tracker
+            assert await raw_redis_client.dbsize() == 6
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+def test_tracked_counters_expire_with_tracker(redis_client, raw_redis_client, layout):
+    rule = {"type": "client", "limit": 100, "window": 60, "max_tracked_keys": 1, "overflow": "deny"}
+    limiter = make_limiter(redis_client, [rule], layout, hash_buckets=1)
+
+    async def scenario():
+        await limiter.is_allowed("10.0.0.1", "a")
+        tracker_ttl = await raw_redis_client.pttl(tracker_key(limiter.rules[0].rule_id, 1 if layout == "hash" else None))
+        for key in await raw_redis_client.keys():
+            assert 0 < await raw_redis_client.pttl(key) <= tracker_ttl
+        # El cliente trackeado sigue pudiendo hacer requests hasta su límite
+        assert await send(limiter, "10.0.0.1", "a", 5) == [True] * 5
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+def test_shared_overflow_counter_expires_with_tracker(redis_client, layout):
+    rule = {"type": "client", "limit": 3, "window": 2, "max_tracked_keys": 1, "overflow": "shared"}
+    limiter = make_limiter(redis_client, [rule], layout, hash_buckets=16)
+    rule_id = limiter.rules[0].rule_id
+    # En la segunda ventana, el cliente trackeado tiene que caer en el mismo hash que el contador compartido,
+    # para que su PEXPIRE no pueda extender la vida de un contador compartido de la ventana anterior
+    overflow_hash = hash_key(rule_id, OVERFLOW_CLIENT, 16)
+    second_client = next(ip for ip in (f"10.1.0.{i}" for i in range(256)) if hash_key(rule_id, pack_ip(ip), 16) == overflow_hash)
+
+    async def scenario():
+        assert await send(limiter, "10.0.0.1", "a", 1) == [True]
+        await asyncio.sleep(1)
+        # El contador compartido se crea a mitad de la ventana del tracker
+        assert await send(limiter, "10.0.0.2", "a", 4) == [True, True, True, False]
+        await asyncio.sleep(1.1)
+        # Nueva ventana: el contador compartido tiene que empezar de cero
+        assert await send(limiter, second_client, "a", 1) == [True]
+        assert await send(limiter, "10.0.0.3", "a", 4) == [True, True, True, False]
+
+    asyncio.run(scenario())
+
+
+def test_hash_layout_changing_max_tracked_keys_starts_fresh_tracker(redis_client):
+    async def scenario():
+        # Con max_tracked_keys = 64 la regla usa 1 hash, y con 128 usa 2, así que los clientes cambian de hash
+        rule = {"type": "client", "limit": 100, "window": 60, "max_tracked_keys": 64, "overflow": "deny"}
+        limiter = make_limiter(redis_client, [rule], "hash")
+        for i in range(64):
+            await limiter.is_allowed(f"10.0.0.{i}", "a")
+
+        rule["max_tracked_keys"] = 128
+        limiter = make_limiter(redis_client, [rule], "hash")
+        # Los clientes trackeados antes no se cuentan dos veces, así que entran 128 clientes distintos
+        results = [await limiter.is_allowed(f"10.0.0.{i}", "a") for i in range(129)]
+        assert results == [True] * 128 + [False]
+
+    asyncio.run(scenario())
+
+
+def test_fail_open_on_redis_error(redis_client, monkeypatch):
+    limiter = make_limiter(redis_client, [{"type": "client", "limit": 1, "window": 60}])
+
+    async def broken_incr(*args, **kwargs):
+        raise redis.ConnectionError("Redis caído")
+
+    monkeypatch.setattr(redis_client, "incr", broken_incr)
+    assert asyncio.run(send(limiter, "10.0.0.1", "a", 3)) == [True, True, True]
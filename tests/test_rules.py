@@ -0,0 +1,128 @@
+"""
+Tests de las reglas: a qué requests aplican, qué claves generan, y cómo se les asigna el id.
+"""
+
+import pytest
+from pydantic import ValidationError
+
+from api_proxy import rules
+from api_proxy.keyspace import pack_ip
+from api_proxy.rules import ClientRule, IPPathRule, IPRule, PathRule, parse_rules
+
+
+def test_generate_key_for_each_rule_type():
+    ip_rule = IPRule(ip="100.100.100.100", limit=1, window=60)
+    path_rule = PathRule(pattern="items/*", limit=1, window=60)
+    ip_path_rule = IPPathRule(ip="100.100.100.102", pattern="categories/*", limit=1, window=60)
+    client_rule = ClientRule(limit=1, window=60)
+
+    # ip e ip_path: rl: + id de la regla + IP de la regla
+    assert ip_rule.generate_key("100.100.100.100", "x") == b"rl:" + ip_rule.rule_id + b"\x64\x64\x64\x64"
+    assert ip_path_rule.generate_key("100.100.100.102", "x") == b"rl:" + ip_path_rule.rule_id + b"\x64\x64\x64\x66"
+    # path: un único contador, sin cliente
+    assert path_rule.generate_key("1.1.1.1", "items/1") == b"rl:" + path_rule.rule_id
+    # client: rl: + id de la regla + IP de la request
+    assert client_rule.generate_key("10.1.2.3", "x") == b"rl:" + client_rule.rule_id + b"\x0a\x01\x02\x03"
+    assert client_rule.generate_key("10.1.2.4", "x") != client_rule.generate_key("10.1.2.3", "x")
+
+
+def test_client_rule_matches():
+    rule = ClientRule(cidr="10.0.0.0/8", pattern="items/*", limit=1, window=60)
+    assert rule.matches("10.1.2.3", "items/MLA1")
+    assert not rule.matches("11.1.2.3", "items/MLA1")
+    assert not rule.matches("10.1.2.3", "users/1")
+    assert not rule.matches("2001:db8::1", "items/MLA1")
+    assert not rule.matches("testclient", "items/MLA1")
+    assert ClientRule(limit=1, window=60).matches("1.2.3.4", "cualquier/ruta")
+    assert rule.client_id("10.1.2.3", "items/MLA1") == pack_ip("10.1.2.3")
+
+
+def test_client_rule_matches_ipv6():
+    # Sin cidr, la regla aplica a todos los clientes, también a los IPv6
+    assert ClientRule(limit=1, window=60).matches("2001:db8::1", "cualquier/ruta")
+    rule = ClientRule(cidr="2001:db8::/32", limit=1, window=60)
+    assert rule.matches("2001:db8::1", "items/MLA1")
+    assert not rule.matches("2001:db9::1", "items/MLA1")
+    assert not rule.matches("10.1.2.3", "items/MLA1")
+    assert rule.client_id("2001:db8::1", "items/MLA1") == pack_ip("2001:db8::1")
+    assert len(rule.generate_key("2001:db8::1", "items/MLA1")) == len(b"rl:") + 4 + 16
+
+
+def test_client_rule_validates_fields():
+    with pytest.raises(ValidationError):
+        ClientRule(cidr="10.0.0.0/33", limit=1, window=60)
+    with pytest.raises(ValidationError):
+        ClientRule(cidr="2001:db8::/129", limit=1, window=60)
+    with pytest.raises(ValidationError):
+        ClientRule(limit=1, window=60, max_tracked_keys=0)
+    with pytest.raises(ValidationError):
+        ClientRule(limit=1, window=60, overflow="drop")
+
+
+def test_parse_rules_assigns_stable_ids():
+    data = {
+        "rules": [
+            {"type": "ip", "ip": "1.1.1.1", "limit": 10, "window": 60},
+            {"type": "path", "pattern": "items/*", "limit": 10, "window": 60},
+            {"type": "client", "limit": 10, "window": 60},
+        ]
+    }
+    first = [rule.rule_id for rule in parse_rules(data)]
+    assert len(set(first)) == 3
+
+    # El id no depende del orden de las reglas, ni de limit/window
+    data["rules"].reverse()
+    for rule in data["rules"]:
+        rule["limit"], rule["window"] = 20, 30
+    second = [rule.rule_id for rule in parse_rules(data)]
+    assert second == list(reversed(first))
+
+
+def test_parse_rules_duplicate_rules_get_distinct_ids():
+    data = {
+        "rules": [
+            {"type": "ip", "ip": "1.1.1.1", "limit": 10, "window": 60},
+            {"type": "ip", "ip": "1.1.1.1", "limit": 100, "window": 3600},
+        ]
+    }
+    parsed = parse_rules(data)
+    assert parsed[0].rule_id != parsed[1].rule_id
+    assert parsed[0].generate_key("1.1.1.1", "x") != parsed[1].generate_key("1.1.1.1", "x")
+
+
+def test_parse_rules_raises_on_id_collision(monkeypatch):
+    monkeypatch.setattr(rules, "make_rule_id", lambda identity: b"\x00\x00\x00\x00")
+    data = {
+        "rules": [
+            {"type": "ip", "ip": "1.1.1.1", "limit": 10, "window": 60},
+            {"type": "ip", "ip": "2.2.2.2", "limit": 10, "window": 60},
+        ]
+    }
+    with pytest.raises(ValueError):
+        parse_rules(data)
+
+
+def test_parse_rules_client_rule():
+    data = {
+        "rules": [
+            {
+                "type": "client",
+                "cidr": "10.0.0.0/8",
+                "pattern": "items/*",
+                "limit": 10,
+                "window": 60,
+                "max_tracked_keys": 1000,
+                "overflow": "deny",
+            }
+        ]
+    }
+    (rule,) = parse_rules(data)
+    assert isinstance(rule, ClientRule)
+    assert rule.max_tracked_keys == 1000
+    assert rule.overflow == "deny"
+
+
+def test_parse_rules_cap_only_on_client_rules():
+    # Las reglas con un único contador no tienen max_tracked_keys (config-spec.json lo rechaza)
+    (rule,) = parse_rules({"rules": [{"type": "ip", "ip": "1.1.1.1", "limit": 10, "window": 60, "max_tracked_keys": 5}]})
+    assert "max_tracked_keys" not in rule.model_dump()